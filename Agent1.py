@@ -1,20 +1,49 @@
 import time
 from datetime import datetime, timedelta, timezone
 import boto3
+from botocore.config import Config
 import shlex
 from strands import Agent, tool
 from strands.models import BedrockModel
+import hashlib
+import json
 import re
 import functools
+import logging
 import os
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict
 
+logging.basicConfig(level=logging.INFO)
+log = logging.getLogger("monitor")
+
 # ---------------- CONFIGURATION ----------------
 REGION = "ap-south-1"
 INSTANCE_ID = "i-0bb4262df055138b2"
 
-ssm_client = boto3.client("ssm", region_name=REGION)
-cloudwatch_client = boto3.client("cloudwatch", region_name=REGION)
+# Shared client config: bigger connection pool + TCP keepalive so the hot
+# polling/metric paths reuse TLS connections instead of re-handshaking, and
+# adaptive retries to absorb CloudWatch/SSM throttling.
+boto_config = Config(
+    region_name=REGION,
+    max_pool_connections=50,
+    tcp_keepalive=True,
+    retries={"mode": "adaptive", "max_attempts": 5},
+    connect_timeout=3,
+    read_timeout=10,
+)
+
+ssm_client = boto3.client("ssm", config=boto_config)
+cloudwatch_client = boto3.client("cloudwatch", config=boto_config)
+ec2_client = boto3.client("ec2", config=boto_config)
+logs_client = boto3.client("logs", config=boto_config)
+
+# SSM stdout is mirrored to this log group so long-running commands can be
+# tailed while they execute instead of waiting for completion.
+SSM_OUTPUT_LOG_GROUP = "/monitor/ssm-out"
+
+# Capped at 8 workers to stay under SSM's concurrent command quota
+ssm_pool = ThreadPoolExecutor(max_workers=8)
 
 # ---------------- AGENT SETUP ----------------
 system_prompt = """
@@ -56,8 +85,9 @@ You are a specialized AWS Infrastructure Monitoring and Optimization Agent that
 
     <step order="2">
     <action>Fetch per-minute CPU and Memory utilization for the last 1 hour for the EC2 instance.</action>
-    <tool>get_metric</tool>
+    <tool>get_metrics_batch</tool>
     <details>
+        <note>Fetch both metrics in a single get_metrics_batch call instead of one get_metric call each.</note>
         <metrics>
             <metric>
                 <name>CPUUtilization</name>
@@ -72,7 +102,7 @@ You are a specialized AWS Infrastructure Monitoring and Optimization Agent that
         </metrics>
         <start_time>One hour ago in UTC</start_time>
         <end_time>Current time minus 1 minute UTC</end_time>
-        <note>Return per-minute data and identify the highest CPU and Memory spikes along with their timestamps.</note>
+        <note>Return per-minute data; use the 'peaks' field returned by get_metrics_batch for the highest CPU and Memory spikes and their timestamps instead of recomputing them.</note>
     </details>
 </step>
 
@@ -92,8 +122,9 @@ You are a specialized AWS Infrastructure Monitoring and Optimization Agent that
 
     <step order="4">
         <action>Analyze Gunicorn processes and identify each website's access and error log paths.</action>
-        <tool>execute_ssm_command</tool>
+        <tool>execute_ssm_script</tool>
         <details>
+            <note>When several diagnostics are known up front, bundle them as labelled steps in one execute_ssm_script call instead of separate commands.</note>
             <logic>
                 - Extract site names
                 - Determine log paths dynamically
@@ -112,6 +143,7 @@ You are a specialized AWS Infrastructure Monitoring and Optimization Agent that
                 <post_spike>10 minutes after spike</post_spike>
             </window>
             <note>Return counts for before, during, and after spike.</note>
+            <note>Issue the per-site count commands in one execute_ssm_commands_parallel call so they run concurrently.</note>
         </details>
     </step>
 
@@ -127,11 +159,12 @@ You are a specialized AWS Infrastructure Monitoring and Optimization Agent that
     </step>
 
     <step order="7">
-        <action>Fetch detailed logs for the spike site in the analysis window.</action>
-        <tool>execute_ssm_command</tool>
+        <action>Fetch a summarized view of the spike site's logs in the analysis window.</action>
+        <tool>execute_ssm_log_query</tool>
         <details>
             <start_time>10 minutes before spike</start_time>
             <end_time>10 minutes after spike</end_time>
+            <note>Use execute_ssm_log_query rather than cat-ing raw logs; it returns the top distinct entries with counts.</note>
         </details>
     </step>
 
@@ -199,12 +232,17 @@ def get_utc_times(period_hours: int = 1, offset_minutes: int = 1):
             "end_time": datetime in UTC
         }
     """
-    from datetime import datetime, timezone, timedelta
     end_time = datetime.now(timezone.utc) - timedelta(minutes=offset_minutes)
     start_time = end_time - timedelta(hours=period_hours)
     return {"start_time": start_time, "end_time": end_time}
 
 
+# Instance state changes on minute-or-longer timescales, so cache status
+# lookups briefly instead of hitting the EC2 API every cycle.
+STATUS_CACHE_TTL = 30
+_status_cache = {}
+
+
 @tool
 def get_ec2_status(instance_id: str):
     """
@@ -222,13 +260,23 @@ def get_ec2_status(instance_id: str):
     Notes:
         - Handles exceptions and returns 'unknown' if API calls fail.
         - Uses boto3 EC2 client to fetch both instance state and health status.
+        - Results are cached for 30 seconds; use refresh_ec2_status to force a refresh.
     """
-     
-    ec2_client = boto3.client("ec2", region_name=REGION)
+    cached = _status_cache.get(instance_id)
+    if cached and time.monotonic() - cached[0] < STATUS_CACHE_TTL:
+        return cached[1]
+
     try:
         response = ec2_client.describe_instances(InstanceIds=[instance_id])
         state = response["Reservations"][0]["Instances"][0]["State"]["Name"]
 
+        # Status checks only exist for running instances; skip the second API
+        # call entirely for stopped/pending/terminated states.
+        if state != "running":
+            result = (state, "n/a", "n/a")
+            _status_cache[instance_id] = (time.monotonic(), result)
+            return result
+
         status_response = ec2_client.describe_instance_status(InstanceIds=[instance_id])
         if status_response["InstanceStatuses"]:
             system_status = status_response["InstanceStatuses"][0]["SystemStatus"]["Status"]
@@ -236,48 +284,329 @@ def get_ec2_status(instance_id: str):
         else:
             system_status = instance_status = "unknown"
 
+        _status_cache[instance_id] = (time.monotonic(), (state, system_status, instance_status))
         return state, system_status, instance_status
     except Exception as e:
-        print(f"Error fetching EC2 status: {e}")
+        log.error("Error fetching EC2 status: %s", e)
         return "unknown", "unknown", "unknown"
 
- 
+
 @tool
-def execute_ssm_command(instance_id: str, command: str) -> str:
+def refresh_ec2_status(instance_id: str):
     """
-    Execute any shell command on an EC2 instance via SSM.
+    Drop the cached status for an instance and fetch it fresh from the EC2 API.
 
     Args:
-        instance_id (str): The EC2 instance ID.
+        instance_id (str): The unique identifier of the EC2 instance.
+
+    Returns:
+        tuple: Same as get_ec2_status.
+    """
+    _status_cache.pop(instance_id, None)
+    return get_ec2_status(instance_id)
+
+
+@tool
+def execute_ssm_command(instance_ids, command: str):
+    """
+    Execute any shell command on one or more EC2 instances via SSM.
+
+    Args:
+        instance_ids: A single EC2 instance ID, or a list of up to 50 IDs.
         command (str): Shell command provided by the agent.
 
     Returns:
-        str: Raw command output (stdout or error).
+        str or Dict[str, str]: Raw command output for a single instance, or a
+        mapping of instance id to output when several IDs are passed.
+
+    Notes:
+        - SSM fans the command out server-side, so a fleet costs one
+          send_command plus one list_command_invocations regardless of size.
     """
+    if isinstance(instance_ids, str):
+        instance_ids = [instance_ids]
     try:
-        print("\nAgent command: ",command)
+        log.debug("Agent command: %s", command)
         # Send the command
         res = ssm_client.send_command(
-            InstanceIds=[instance_id],
+            InstanceIds=instance_ids,
             DocumentName="AWS-RunShellScript",
             Parameters={"commands": [command]},
-            TimeoutSeconds=60
+            TimeoutSeconds=60,
+            CloudWatchOutputConfig={
+                "CloudWatchLogGroupName": SSM_OUTPUT_LOG_GROUP,
+                "CloudWatchOutputEnabled": True,
+            }
         )
         cmd_id = res['Command']['CommandId']
 
-        # Wait for command to finish
-        status = ""
-        while status not in ["Success", "Failed", "Cancelled"]:
-            time.sleep(1)
-            output = ssm_client.get_command_invocation(CommandId=cmd_id, InstanceId=instance_id)
-            status = output['Status']
-        print("\nSSM RESULT: ",output.get("StandardOutputContent", "").strip() or "No output returned")
-        return output.get("StandardOutputContent", "").strip() or "No output returned"
-    
+        # Wait for each instance to finish (server-tuned backoff instead of 1s
+        # polling); instances execute in parallel so this waits ~max duration.
+        waiter = ssm_client.get_waiter("command_executed")
+        for instance_id in instance_ids:
+            try:
+                waiter.wait(CommandId=cmd_id, InstanceId=instance_id,
+                            WaiterConfig={"Delay": 1, "MaxAttempts": 60})
+            except Exception:
+                pass  # waiter raises on Failed/Cancelled too; fetch the final state below
+
+        if len(instance_ids) == 1:
+            output = ssm_client.get_command_invocation(CommandId=cmd_id, InstanceId=instance_ids[0])
+            log.debug("SSM RESULT: %s", output.get("StandardOutputContent", "").strip() or "No output returned")
+            return output.get("StandardOutputContent", "").strip() or "No output returned"
+
+        # One reap call covers the whole fleet
+        resp = ssm_client.list_command_invocations(CommandId=cmd_id, Details=True)
+        return {
+            inv["InstanceId"]: (inv["CommandPlugins"][0].get("Output", "").strip() or "No output returned")
+            for inv in resp.get("CommandInvocations", [])
+        }
+
     except Exception as e:
         return f"Error executing command: {e}"
 
 
+@tool
+def execute_ssm_commands_parallel(instance_id: str, commands: List[str]) -> Dict[str, str]:
+    """
+    Run several independent shell commands on an EC2 instance concurrently.
+
+    Args:
+        instance_id (str): The EC2 instance ID.
+        commands (List[str]): Independent shell commands to run at the same time.
+
+    Returns:
+        Dict[str, str]: Mapping of each command to its raw output.
+
+    Notes:
+        - Each command is its own SSM invocation but they run in parallel, so the
+          wall time is roughly one SSM round-trip instead of N sequential ones.
+        - Use this when several diagnostics (e.g. per-site log counts) are known
+          up front and do not depend on each other.
+    """
+    futures = {cmd: ssm_pool.submit(execute_ssm_command, instance_id, cmd) for cmd in commands}
+    return {cmd: fut.result() for cmd, fut in futures.items()}
+
+
+def stream_command_output(cmd_id: str, instance_id: str, poll_interval: float = 0.5) -> str:
+    """
+    Follow a command's stdout from CloudWatch Logs while it is still running.
+
+    Args:
+        cmd_id (str): The SSM command id.
+        instance_id (str): The EC2 instance ID.
+        poll_interval (float): Delay between reads of the live log stream.
+
+    Returns:
+        str: The full streamed output once the command reaches a terminal state.
+
+    Notes:
+        - Output chunks arrive in near-real-time via the mirrored log group, so
+          long scripts are consumed as they run instead of in one blob at the end.
+        - Falls back to get_command_invocation if the log stream never appears.
+    """
+    stream_name = f"{cmd_id}/{instance_id}/aws-runShellScript/stdout"
+    chunks = []
+    next_token = None
+    while True:
+        try:
+            kwargs = {
+                "logGroupName": SSM_OUTPUT_LOG_GROUP,
+                "logStreamName": stream_name,
+                "startFromHead": True,
+            }
+            if next_token:
+                kwargs["nextToken"] = next_token
+            resp = logs_client.get_log_events(**kwargs)
+            chunks.extend(e["message"] for e in resp.get("events", []))
+            next_token = resp.get("nextForwardToken", next_token)
+        except Exception:
+            pass  # the stream may not exist yet right after send_command
+
+        # Lightweight status check (no output payload) to detect completion
+        invocations = ssm_client.list_command_invocations(
+            CommandId=cmd_id, InstanceId=instance_id, Details=False
+        ).get("CommandInvocations", [])
+        status = invocations[0].get("Status", "") if invocations else ""
+        if status in ("Success", "Failed", "Cancelled", "TimedOut"):
+            break
+        time.sleep(poll_interval)
+
+    if chunks:
+        return "\n".join(chunks).strip()
+    output = ssm_client.get_command_invocation(CommandId=cmd_id, InstanceId=instance_id)
+    return output.get("StandardOutputContent", "").strip()
+
+
+@tool
+def execute_ssm_script(instance_id: str, steps: List[List[str]]) -> Dict[str, str]:
+    """
+    Run several labelled shell commands in ONE SSM invocation.
+
+    Args:
+        instance_id (str): The EC2 instance ID.
+        steps (List[List[str]]): [name, command] pairs, executed in order.
+
+    Returns:
+        Dict[str, str]: Mapping of each step name to its output.
+
+    Notes:
+        - A single AWS-RunShellScript invocation runs every step, so the fixed
+          send/pickup/poll overhead is paid once instead of once per command.
+        - Prefer this over separate execute_ssm_command calls when the commands
+          are known up front (e.g. log-path discovery plus log counts).
+    """
+    try:
+        script = "\n".join(
+            f'echo "===BEGIN:{name}==="\n{cmd}\necho "===END:{name}==="'
+            for name, cmd in steps
+        )
+        res = ssm_client.send_command(
+            InstanceIds=[instance_id],
+            DocumentName="AWS-RunShellScript",
+            Parameters={"commands": [script]},
+            TimeoutSeconds=120,
+            CloudWatchOutputConfig={
+                "CloudWatchLogGroupName": SSM_OUTPUT_LOG_GROUP,
+                "CloudWatchOutputEnabled": True,
+            }
+        )
+        cmd_id = res['Command']['CommandId']
+
+        # Multi-step scripts can run long; tail the mirrored log stream as the
+        # steps execute rather than blocking on the completion waiter.
+        stdout = stream_command_output(cmd_id, instance_id)
+
+        results = {}
+        for name, _ in steps:
+            begin, end = f"===BEGIN:{name}===", f"===END:{name}==="
+            if begin in stdout and end in stdout:
+                results[name] = stdout.split(begin, 1)[1].split(end, 1)[0].strip() or "No output returned"
+            else:
+                results[name] = "No output returned"
+        return results
+
+    except Exception as e:
+        return {"error": f"Error executing script: {e}"}
+
+
+@tool
+def execute_ssm_log_query(instance_id: str, log_path: str, start_time: str, end_time: str, pattern: str = "") -> str:
+    """
+    Summarize a log file window on the instance instead of shipping raw logs.
+
+    Args:
+        instance_id (str): The EC2 instance ID.
+        log_path (str): Full path to the log file.
+        start_time (str): Window start in access-log format "dd/Mon/YYYY:HH:MM:SS".
+        end_time (str): Window end in the same format.
+        pattern (str): Optional grep -E pattern applied before summarizing.
+
+    Returns:
+        str: Top 50 distinct log lines with occurrence counts, most frequent first.
+
+    Notes:
+        - Filtering and aggregation happen on the instance, so only ~50 summary
+          lines come back instead of the raw (potentially huge) log window.
+    """
+    grep = f" | grep -E '{pattern}'" if pattern else ""
+    cmd = (
+        f"awk -v start='{start_time}' -v end='{end_time}' "
+        f"'{{ t = substr($4, 2, 20); if (t >= start && t <= end) print }}' {log_path}"
+        f"{grep} | sort | uniq -c | sort -rn | head -50"
+    )
+    return execute_ssm_command(instance_id, cmd)
+
+
+@tool
+def get_metrics_batch(queries: List[Dict], start_time: datetime, end_time: datetime) -> Dict[str, List[Dict]]:
+    """
+    Fetch several per-minute metrics in a single CloudWatch GetMetricData call.
+
+    Args:
+        queries: list of dicts, one per metric:
+            [{"namespace": "AWS/EC2", "metric_name": "CPUUtilization",
+              "dimensions": [{"Name": "InstanceId", "Value": "i-..."}], "label": "CPU"}, ...]
+        start_time: start datetime
+        end_time: end datetime
+
+    Returns:
+        Dict with the per-minute series and the pre-computed spike per metric:
+            {'series': {'<label>': [{'Timestamp': datetime, '<label>': value}, ...], ...},
+             'peaks': {'<label>': {'Timestamp': datetime, 'value': value}, ...}}
+
+    Notes:
+        - One API round-trip covers up to 500 metrics instead of one call each.
+        - Paginates on NextToken for long windows.
+        - The spike value is computed by CloudWatch Metric Math (MAX(m)) in the
+          same call; trust 'peaks' instead of re-scanning the series.
+    """
+    try:
+        metric_queries = []
+        for i, q in enumerate(queries):
+            metric_queries.append({
+                "Id": f"m{i}",
+                "MetricStat": {
+                    "Metric": {
+                        "Namespace": q["namespace"],
+                        "MetricName": q["metric_name"],
+                        "Dimensions": q.get("dimensions", []),
+                    },
+                    "Period": 60,
+                    "Stat": "Average",
+                },
+                "ReturnData": True,
+            })
+            # Metric math companion query: CloudWatch computes the peak server-side
+            metric_queries.append({
+                "Id": f"m{i}peak",
+                "Expression": f"MAX(m{i})",
+                "Label": f"{q.get('label', f'm{i}')}Peak",
+                "ReturnData": True,
+            })
+        label_by_id = {f"m{i}": q.get("label", f"m{i}") for i, q in enumerate(queries)}
+        peak_label_by_id = {f"m{i}peak": q.get("label", f"m{i}") for i, q in enumerate(queries)}
+        series = {label: [] for label in label_by_id.values()}
+        peaks = {}
+
+        next_token = None
+        while True:
+            kwargs = {
+                "MetricDataQueries": metric_queries,
+                "StartTime": start_time,
+                "EndTime": end_time,
+                "ScanBy": "TimestampAscending",
+            }
+            if next_token:
+                kwargs["NextToken"] = next_token
+            resp = cloudwatch_client.get_metric_data(**kwargs)
+            for res in resp.get("MetricDataResults", []):
+                if res["Id"] in peak_label_by_id:
+                    label = peak_label_by_id[res["Id"]]
+                    if res.get("Values"):
+                        peaks[label] = {"value": max(res["Values"])}
+                    continue
+                label = label_by_id.get(res["Id"], res["Id"])
+                series.setdefault(label, []).extend(
+                    {"Timestamp": t, label: v} for t, v in zip(res["Timestamps"], res["Values"])
+                )
+            next_token = resp.get("NextToken")
+            if not next_token:
+                break
+
+        # ScanBy=TimestampAscending means CloudWatch already returns the points
+        # in time order, so no Python-side sort is needed.
+        for label in series:
+            # attach the spike timestamp from the series point matching the peak
+            if series[label]:
+                spike = max(series[label], key=lambda x: x[label])
+                peaks.setdefault(label, {"value": spike[label]})["Timestamp"] = spike["Timestamp"]
+        return {"series": series, "peaks": peaks}
+    except Exception as e:
+        log.error("Error fetching metrics batch: %s", e)
+        return {"series": {}, "peaks": {}}
+
+
 @tool
 def get_metric(instance_id: str, start_time: datetime, end_time: datetime, metric_name: str, namespace: str, label: str) -> List[Dict]:
     """
@@ -294,34 +623,65 @@ def get_metric(instance_id: str, start_time: datetime, end_time: datetime, metri
     Returns:
         List of dicts: [{'Timestamp': datetime, '<label>': value}, ...]
     """
-    try:
-        resp = cloudwatch_client.get_metric_statistics(
-            Namespace=namespace,
-            MetricName=metric_name,
-            Dimensions=[{"Name": "InstanceId", "Value": instance_id}],
-            StartTime=start_time,
-            EndTime=end_time,
-            Period=60,
-            Statistics=["Average"]
-        )
-        points = sorted(resp.get("Datapoints", []), key=lambda x: x["Timestamp"])
-        return [{"Timestamp": dp["Timestamp"], label: dp["Average"]} for dp in points]
-    except Exception as e:
-        print(f"Error fetching {metric_name}: {e}")
-        return []
+    result = get_metrics_batch(
+        [{
+            "namespace": namespace,
+            "metric_name": metric_name,
+            "dimensions": [{"Name": "InstanceId", "Value": instance_id}],
+            "label": label,
+        }],
+        start_time,
+        end_time,
+    )
+    return result.get("series", {}).get(label, [])
 
 print("🌐 Started Monitoring...")
 
+# Build the agent once; reconstructing it every iteration re-parses the
+# multi-KB system prompt and rebuilds the Bedrock client for no benefit.
+tools = [ execute_ssm_command,execute_ssm_commands_parallel,execute_ssm_script,execute_ssm_log_query,get_utc_times,get_ec2_status,refresh_ec2_status,get_metrics_batch,get_metric]
+monitor_agent = Agent(name="MonitorAgent", system_prompt=system_prompt, model=model,tools=tools)
+
+# Fingerprint of the last analyzed state: when status and metric peaks are
+# unchanged, the Bedrock call (by far the most expensive step) is skipped.
+_last_fp = None
+_last_result = None
+_last_ts = 0.0
+FINGERPRINT_MAX_AGE = 300
+
 while True:
     try:
 
-        tools = [ execute_ssm_command,get_utc_times,get_ec2_status,get_metric]
-
-        monitor_agent = Agent(name="MonitorAgent", system_prompt=system_prompt, model=model,tools=tools)
+        status_tuple = get_ec2_status(INSTANCE_ID)
+        times = get_utc_times()
+        metrics = get_metrics_batch(
+            [{"namespace": "AWS/EC2", "metric_name": "CPUUtilization",
+              "dimensions": [{"Name": "InstanceId", "Value": INSTANCE_ID}], "label": "CPU"},
+             {"namespace": "CWAgent", "metric_name": "mem_used_percent",
+              "dimensions": [{"Name": "InstanceId", "Value": INSTANCE_ID}], "label": "Memory"}],
+            times["start_time"], times["end_time"])
+        peaks = metrics.get("peaks", {})
+        fingerprint = hashlib.blake2b(
+            json.dumps({
+                "status": status_tuple,
+                "cpu_peak": round(peaks.get("CPU", {}).get("value", 0.0), 1),
+                "mem_peak": round(peaks.get("Memory", {}).get("value", 0.0), 1),
+            }).encode(),
+            digest_size=16,
+        ).hexdigest()
+
+        if fingerprint == _last_fp and time.time() - _last_ts < FINGERPRINT_MAX_AGE:
+            result = _last_result
+            print("Instance state unchanged since last analysis; skipping agent run.")
+        else:
+            # Each iteration is a fresh analysis; clear the shared agent's
+            # conversation state so earlier iterations' tool transcripts
+            # don't ride along in (and inflate) this call's prompt
+            monitor_agent.messages = []
+            result = monitor_agent(f"The instance id is {INSTANCE_ID} . Analyze the ec2 instance from the available tools and tell the issue and root cause: ")
+            # print("\nAGENT RESPONSE:\n", result)
+            _last_fp, _last_result, _last_ts = fingerprint, result, time.time()
 
-        result = monitor_agent(f"The instance id is {INSTANCE_ID} . Analyze the ec2 instance from the available tools and tell the issue and root cause: ")
-        # print("\nAGENT RESPONSE:\n", result)
-        
     except Exception as e:
         print(f"An error occurred in the main monitoring loop: {e}")
     
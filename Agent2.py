@@ -1,21 +1,45 @@
 import time
 from datetime import datetime, timedelta, timezone
 import boto3
+from botocore.config import Config
 import shlex
 from strands import Agent, tool
 from strands.models import BedrockModel
 import re
 import functools
+import logging
 import os
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict
 
+logging.basicConfig(level=logging.INFO)
+log = logging.getLogger("monitor")
+
 # ---------------- CONFIGURATION ----------------
 REGION = "ap-south-1"
 INSTANCE_ID = "i-0bb4262df055138b2"
 
-ssm_client = boto3.client("ssm", region_name=REGION)
-cloudwatch_client = boto3.client("cloudwatch", region_name=REGION)
-flag=False
+# Shared client config: bigger connection pool + TCP keepalive so the hot
+# polling/metric paths reuse TLS connections instead of re-handshaking, and
+# adaptive retries to absorb CloudWatch/SSM throttling.
+boto_config = Config(
+    region_name=REGION,
+    max_pool_connections=50,
+    tcp_keepalive=True,
+    retries={"mode": "adaptive", "max_attempts": 5},
+    connect_timeout=3,
+    read_timeout=10,
+)
+
+ssm_client = boto3.client("ssm", config=boto_config)
+cloudwatch_client = boto3.client("cloudwatch", config=boto_config)
+
+# SSM stdout is mirrored to this log group so long-running commands can be
+# tailed while they execute instead of waiting for completion.
+SSM_OUTPUT_LOG_GROUP = "/monitor/ssm-out"
+
+# Capped at 8 workers to stay under SSM's concurrent command quota
+ssm_pool = ThreadPoolExecutor(max_workers=8)
 # ---------------- AGENT SETUP ----------------
 system_prompt = """
 <system_prompt>
@@ -46,21 +70,25 @@ system_prompt = """
       <step number="1">
         <action>Check configuration files directly related to the affected service using read-only commands (cat, grep).</action>
         <focus>Detect typos, missing letters, or syntax errors that could prevent service startup.</focus>
+        <note>When several diagnostics are known up front, bundle them as labelled steps in one execute_ssm_script call instead of separate commands.</note>
       </step>
-      
+
       <step number="2">
         <action>Examine service logs and journal logs for errors related to the affected service.</action>
         <scope>Focus only on logs indicating startup, runtime, or dependency failures.</scope>
+        <note>Issue independent log inspections in one execute_ssm_commands_parallel call so they run concurrently.</note>
       </step>
-      
+
       <step number="3">
-        <action>Only after inspecting configs and logs, gather CloudWatch metrics using get_metric() for the failing service timeframe.</action>
+        <action>Only after inspecting configs and logs, gather CloudWatch metrics using get_metrics_batch() for the failing service timeframe.</action>
         <scope>Include CPU, memory, disk, and network metrics only if relevant to service failure.</scope>
+        <note>Fetch all needed metrics in a single get_metrics_batch call instead of one get_metric call each.</note>
       </step>
-      
+
       <step number="4">
         <action>Fetch RDS metrics for anomaly timestamps</action>
         <condition>Execute only if EC2 anomalies are detected that may impact the database</condition>
+        <note>Append the RDS queries to the same get_metrics_batch call as the EC2 metrics when both are needed.</note>
       </step>
       
       <step number="5">
@@ -197,93 +225,273 @@ def get_utc_times(period_hours: int = 1, offset_minutes: int = 1):
             "end_time": datetime in UTC
         }
     """
-    from datetime import datetime, timezone, timedelta
     end_time = datetime.now(timezone.utc) - timedelta(minutes=offset_minutes)
     start_time = end_time - timedelta(hours=period_hours)
     return {"start_time": start_time, "end_time": end_time}
 
  
 @tool
-def execute_ssm_command(instance_id: str, command: str) -> str:
+def execute_ssm_command(instance_ids, command: str):
     """
-    Execute any shell command on an EC2 instance via SSM.
+    Execute any shell command on one or more EC2 instances via SSM.
 
     Args:
-        instance_id (str): The EC2 instance ID.
+        instance_ids: A single EC2 instance ID, or a list of up to 50 IDs.
         command (str): Shell command provided by the agent.
 
     Returns:
-        str: Raw command output (stdout or error).
+        str or Dict[str, str]: Raw command output for a single instance, or a
+        mapping of instance id to output when several IDs are passed.
+
+    Notes:
+        - SSM fans the command out server-side, so a fleet costs one
+          send_command plus one list_command_invocations regardless of size.
     """
+    if isinstance(instance_ids, str):
+        instance_ids = [instance_ids]
     try:
-        if flag:
-            print("\nAgent command: ",command)
+        log.debug("Agent command: %s", command)
         # Send the command
         res = ssm_client.send_command(
-            InstanceIds=[instance_id],
+            InstanceIds=instance_ids,
             DocumentName="AWS-RunShellScript",
             Parameters={"commands": [command]},
-            TimeoutSeconds=60
+            TimeoutSeconds=60,
+            CloudWatchOutputConfig={
+                "CloudWatchLogGroupName": SSM_OUTPUT_LOG_GROUP,
+                "CloudWatchOutputEnabled": True,
+            }
         )
         cmd_id = res['Command']['CommandId']
 
-        # Wait for command to finish
-        status = ""
-        while status not in ["Success", "Failed", "Cancelled"]:
-            time.sleep(1)
-            output = ssm_client.get_command_invocation(CommandId=cmd_id, InstanceId=instance_id)
-            status = output['Status']
-        if flag:
-            print("\nSSM RESULT: ",output.get("StandardOutputContent", "").strip() or "No output returned")
-        return output.get("StandardOutputContent", "").strip() or "No output returned"
-    
+        # Wait for each instance to finish (server-tuned backoff instead of 1s
+        # polling); instances execute in parallel so this waits ~max duration.
+        waiter = ssm_client.get_waiter("command_executed")
+        for instance_id in instance_ids:
+            try:
+                waiter.wait(CommandId=cmd_id, InstanceId=instance_id,
+                            WaiterConfig={"Delay": 1, "MaxAttempts": 60})
+            except Exception:
+                pass  # waiter raises on Failed/Cancelled too; fetch the final state below
+
+        if len(instance_ids) == 1:
+            output = ssm_client.get_command_invocation(CommandId=cmd_id, InstanceId=instance_ids[0])
+            log.debug("SSM RESULT: %s", output.get("StandardOutputContent", "").strip() or "No output returned")
+            return output.get("StandardOutputContent", "").strip() or "No output returned"
+
+        # One reap call covers the whole fleet
+        resp = ssm_client.list_command_invocations(CommandId=cmd_id, Details=True)
+        return {
+            inv["InstanceId"]: (inv["CommandPlugins"][0].get("Output", "").strip() or "No output returned")
+            for inv in resp.get("CommandInvocations", [])
+        }
+
     except Exception as e:
         return f"Error executing command: {e}"
 
 
+@tool
+def execute_ssm_commands_parallel(instance_id: str, commands: List[str]) -> Dict[str, str]:
+    """
+    Run several independent shell commands on an EC2 instance concurrently.
+
+    Args:
+        instance_id (str): The EC2 instance ID.
+        commands (List[str]): Independent shell commands to run at the same time.
+
+    Returns:
+        Dict[str, str]: Mapping of each command to its raw output.
+
+    Notes:
+        - Each command is its own SSM invocation but they run in parallel, so the
+          wall time is roughly one SSM round-trip instead of N sequential ones.
+        - Use this when several diagnostics are known up front and do not depend
+          on each other.
+    """
+    futures = {cmd: ssm_pool.submit(execute_ssm_command, instance_id, cmd) for cmd in commands}
+    return {cmd: fut.result() for cmd, fut in futures.items()}
+
+
+@tool
+def execute_ssm_script(instance_id: str, steps: List[List[str]]) -> Dict[str, str]:
+    """
+    Run several labelled shell commands in ONE SSM invocation.
+
+    Args:
+        instance_id (str): The EC2 instance ID.
+        steps (List[List[str]]): [name, command] pairs, executed in order.
+
+    Returns:
+        Dict[str, str]: Mapping of each step name to its output.
+
+    Notes:
+        - A single AWS-RunShellScript invocation runs every step, so the fixed
+          send/pickup/poll overhead is paid once instead of once per command.
+        - Prefer this over separate execute_ssm_command calls when the commands
+          are known up front.
+    """
+    try:
+        script = "\n".join(
+            f'echo "===BEGIN:{name}==="\n{cmd}\necho "===END:{name}==="'
+            for name, cmd in steps
+        )
+        res = ssm_client.send_command(
+            InstanceIds=[instance_id],
+            DocumentName="AWS-RunShellScript",
+            Parameters={"commands": [script]},
+            TimeoutSeconds=120,
+            CloudWatchOutputConfig={
+                "CloudWatchLogGroupName": SSM_OUTPUT_LOG_GROUP,
+                "CloudWatchOutputEnabled": True,
+            }
+        )
+        cmd_id = res['Command']['CommandId']
+
+        waiter = ssm_client.get_waiter("command_executed")
+        try:
+            waiter.wait(CommandId=cmd_id, InstanceId=instance_id,
+                        WaiterConfig={"Delay": 1, "MaxAttempts": 120})
+        except Exception:
+            pass
+        output = ssm_client.get_command_invocation(CommandId=cmd_id, InstanceId=instance_id)
+        stdout = output.get("StandardOutputContent", "")
+
+        results = {}
+        for name, _ in steps:
+            begin, end = f"===BEGIN:{name}===", f"===END:{name}==="
+            if begin in stdout and end in stdout:
+                results[name] = stdout.split(begin, 1)[1].split(end, 1)[0].strip() or "No output returned"
+            else:
+                results[name] = "No output returned"
+        return results
+
+    except Exception as e:
+        return {"error": f"Error executing script: {e}"}
+
+
+@tool
+def get_metrics_batch(queries: List[Dict], start_time: datetime, end_time: datetime) -> Dict[str, List[Dict]]:
+    """
+    Fetch several per-minute metrics in a single CloudWatch GetMetricData call.
+
+    Args:
+        queries: list of dicts, one per metric:
+            [{"namespace": "AWS/EC2", "metric_name": "CPUUtilization",
+              "dimensions": [{"Name": "InstanceId", "Value": "i-..."}], "label": "CPU"}, ...]
+        start_time: Start datetime for the metrics.
+        end_time: End datetime for the metrics.
+
+    Returns:
+        Dict with the per-minute series and the pre-computed spike per metric:
+            {'series': {'<label>': [{'Timestamp': datetime, '<label>': value}, ...], ...},
+             'peaks': {'<label>': {'Timestamp': datetime, 'value': value}, ...}}
+
+    Notes:
+        - One API round-trip covers up to 500 metrics instead of one call each.
+        - Paginates on NextToken for long windows.
+        - The spike value is computed by CloudWatch Metric Math (MAX(m)) in the
+          same call; trust 'peaks' instead of re-scanning the series.
+    """
+    try:
+        metric_queries = []
+        for i, q in enumerate(queries):
+            metric_queries.append({
+                "Id": f"m{i}",
+                "MetricStat": {
+                    "Metric": {
+                        "Namespace": q["namespace"],
+                        "MetricName": q["metric_name"],
+                        "Dimensions": q.get("dimensions", []),
+                    },
+                    "Period": 60,
+                    "Stat": "Average",
+                },
+                "ReturnData": True,
+            })
+            # Metric math companion query: CloudWatch computes the peak server-side
+            metric_queries.append({
+                "Id": f"m{i}peak",
+                "Expression": f"MAX(m{i})",
+                "Label": f"{q.get('label', f'm{i}')}Peak",
+                "ReturnData": True,
+            })
+        label_by_id = {f"m{i}": q.get("label", f"m{i}") for i, q in enumerate(queries)}
+        peak_label_by_id = {f"m{i}peak": q.get("label", f"m{i}") for i, q in enumerate(queries)}
+        series = {label: [] for label in label_by_id.values()}
+        peaks = {}
+
+        next_token = None
+        while True:
+            kwargs = {
+                "MetricDataQueries": metric_queries,
+                "StartTime": start_time,
+                "EndTime": end_time,
+                "ScanBy": "TimestampAscending",
+            }
+            if next_token:
+                kwargs["NextToken"] = next_token
+            resp = cloudwatch_client.get_metric_data(**kwargs)
+            for res in resp.get("MetricDataResults", []):
+                if res["Id"] in peak_label_by_id:
+                    label = peak_label_by_id[res["Id"]]
+                    if res.get("Values"):
+                        peaks[label] = {"value": max(res["Values"])}
+                    continue
+                label = label_by_id.get(res["Id"], res["Id"])
+                series.setdefault(label, []).extend(
+                    {"Timestamp": t, label: v} for t, v in zip(res["Timestamps"], res["Values"])
+                )
+            next_token = resp.get("NextToken")
+            if not next_token:
+                break
+
+        # ScanBy=TimestampAscending means CloudWatch already returns the points
+        # in time order, so no Python-side sort is needed.
+        for label in series:
+            # attach the spike timestamp from the series point matching the peak
+            if series[label]:
+                spike = max(series[label], key=lambda x: x[label])
+                peaks.setdefault(label, {"value": spike[label]})["Timestamp"] = spike["Timestamp"]
+        return {"series": series, "peaks": peaks}
+    except Exception as e:
+        log.error("Error fetching metrics batch: %s", e)
+        return {"series": {}, "peaks": {}}
+
+
 @tool
 def get_metric(dim_name:str,value_id: str, start_time: datetime, end_time: datetime, metric_name: str, namespace: str, label: str) -> List[Dict]:
     """
     Args:
-        dim_name: The name of the CloudWatch dimension (e.g., "InstanceId" for EC2, 
+        dim_name: The name of the CloudWatch dimension (e.g., "InstanceId" for EC2,
                   "DBInstanceIdentifier" for RDS).
         value_id: The value of the dimension (e.g., EC2 instance ID or RDS DB instance identifier).
         start_time: Start datetime for the metrics.
         end_time: End datetime for the metrics.
         metric_name: CloudWatch metric name (e.g., "CPUUtilization", "FreeableMemory").
         namespace: CloudWatch namespace (e.g., "AWS/EC2", "AWS/RDS", "CWAgent").
-        label: Key name to use for the value in the returned list of dicts 
+        label: Key name to use for the value in the returned list of dicts
                (e.g., "CPU", "Memory").
 
     Returns:
         List of dicts: [{'Timestamp': datetime, '<label>': value}, ...]
     """
-    try:
-        if flag:            
-            print("\n",metric_name)
-            print("\n",namespace)
-        resp = cloudwatch_client.get_metric_statistics(
-            Namespace=namespace,
-            MetricName=metric_name,
-            Dimensions=[{"Name": dim_name, "Value": value_id}],
-            StartTime=start_time,
-            EndTime=end_time,
-            Period=60,
-            Statistics=["Average"]
-        )
-
-        points = sorted(resp.get("Datapoints", []), key=lambda x: x["Timestamp"])
-        if flag:
-            print(f"\nMetric Output: {[{"Timestamp": dp["Timestamp"], label: dp["Average"]} for dp in points]} ")
-        return [{"Timestamp": dp["Timestamp"], label: dp["Average"]} for dp in points]
-    except Exception as e:
-        print(f"Error fetching {metric_name}: {e}")
-        return []
+    log.debug("Fetching metric %s from namespace %s", metric_name, namespace)
+    result = get_metrics_batch(
+        [{
+            "namespace": namespace,
+            "metric_name": metric_name,
+            "dimensions": [{"Name": dim_name, "Value": value_id}],
+            "label": label,
+        }],
+        start_time,
+        end_time,
+    )
+    return result.get("series", {}).get(label, [])
 
 print("📊 CloudWatch + SSM Monitoring Started...")  
 try:
 
-    tools = [ execute_ssm_command,get_utc_times,get_metric]
+    tools = [ execute_ssm_command,execute_ssm_commands_parallel,execute_ssm_script,get_utc_times,get_metrics_batch,get_metric]
 
     monitor_agent = Agent(name="MonitorAgent", system_prompt=system_prompt, model=model,tools=tools)
 
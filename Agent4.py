@@ -1,20 +1,48 @@
+import hashlib
+import logging
+import queue
+import threading
 import time
+from logging.handlers import QueueHandler, QueueListener
 from datetime import datetime, timedelta, timezone
+import json
 import boto3
+from botocore.config import Config
 from strands import Agent, tool
 from strands.models import BedrockModel
 from typing import List, Dict
 from fastapi import FastAPI, Request
+from fastapi.responses import ORJSONResponse
+import orjson
 import uvicorn
-import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from sentence_transformers import SentenceTransformer
 # ---------------- CONFIGURATION ----------------
 REGION = "ap-south-1"
 INSTANCE_ID = "i-0bb4262df055138b2"
 
-ssm_client = boto3.client("ssm", region_name=REGION)
-cloudwatch_client = boto3.client("cloudwatch", region_name=REGION)
-flag = True
+# Pool sized for concurrent agent threads hitting SSM/CloudWatch at once;
+# keepalive avoids re-handshaking TLS between tool calls
+boto_config = Config(
+    max_pool_connections=20,
+    tcp_keepalive=True,
+    retries={"max_attempts": 5, "mode": "adaptive"},
+)
+ssm_client = boto3.client("ssm", region_name=REGION, config=boto_config)
+cloudwatch_client = boto3.client("cloudwatch", region_name=REGION, config=boto_config)
+
+# Log through a queue so formatting/flushing happens on the listener thread,
+# not inside agent threads holding the GIL mid-request
+_log_queue = queue.SimpleQueue()
+_log_listener = QueueListener(_log_queue, logging.StreamHandler())
+_log_listener.start()
+log = logging.getLogger("agent")
+log.setLevel(logging.INFO)
+log.addHandler(QueueHandler(_log_queue))
 
 # ---------------- AGENT SETUP ----------------
 system_prompt = """
@@ -65,16 +93,18 @@ system_prompt = """
       <step number="3">
         <action>Gather metrics for the failing service timeframe using appropriate tools</action>
         <metrics_collection>
-          <prometheus_metrics tool="query_prometheus">
+          <prometheus_metrics tool="query_prometheus_multi">
             <metric>CPU utilization and usage patterns</metric>
             <metric>Memory consumption and availability</metric>
             <metric>Disk usage and I/O metrics</metric>
             <metric>NGINX performance metrics (requests per second, active connections, request duration, upstream response time, HTTP status codes)</metric>
+            <note>Batch all PromQL queries for the window into one query_prometheus_multi call; they run in parallel. Use query_prometheus only for a single ad-hoc query.</note>
           </prometheus_metrics>
-          <cloudwatch_metrics tool="get_metric">
+          <cloudwatch_metrics tool="get_metrics_batch">
             <metric namespace="AWS/EC2">NetworkIn, NetworkOut</metric>
             <metric namespace="AWS/RDS">ReadLatency, WriteLatency, DatabaseConnections</metric>
             <metric>All other service-specific metrics not covered by Prometheus</metric>
+            <note>Fetch all CloudWatch metrics for the window in one get_metrics_batch call; use get_metric only for a single ad-hoc metric.</note>
           </cloudwatch_metrics>
         </metrics_collection>
         <scope>Include metrics only if relevant to service failure</scope>
@@ -262,18 +292,72 @@ model = BedrockModel(
 )
 PROMETHEUS_URL = "http://35.154.61.63:9090"
 
+# Reuse one pooled session for all Prometheus queries so repeated PromQL
+# calls share TCP connections instead of handshaking every time. Transient
+# 5xx from a loaded Prometheus retries at the transport layer — far cheaper
+# than letting the error bubble up and having the LLM re-plan the query.
+_PROM_RETRY = Retry(total=3, backoff_factor=0.3,
+                    status_forcelist=[502, 503, 504], allowed_methods={"GET"})
+_PROM_SESSION = requests.Session()
+_PROM_SESSION.mount("http://", HTTPAdapter(max_retries=_PROM_RETRY,
+                                           pool_connections=10, pool_maxsize=20))
+
+# The agent often re-issues the same query for the same pinned anomaly window
+# while iterating hypotheses; cache those lookups briefly to skip the HTTP
+# round-trip on repeats.
+METRIC_CACHE_TTL = 60
+_metric_cache = {}
+
+# Config files / hardware facts don't change inside an anomaly window, so
+# repeated "cat /etc/nginx/nginx.conf"-style asks can skip the 1-3s SSM
+# round-trip. Time-sensitive commands are never cached.
+SSM_CACHE_TTL = 300
+_ssm_cache = {}
+_NON_CACHEABLE_PREFIXES = ("ps", "top", "free", "df", "journalctl", "tail")
+# Live evidence paths: anything reading logs or kernel state must reflect
+# the incident as it is now, never a 5-minute-old snapshot
+_NON_CACHEABLE_PATHS = ("/var/log", "/proc")
+
+def _ssm_cacheable(command: str) -> bool:
+    command = command.strip()
+    if command.startswith(_NON_CACHEABLE_PREFIXES):
+        return False
+    return not any(p in command for p in _NON_CACHEABLE_PATHS)
+
+def _metric_cache_get(key):
+    hit = _metric_cache.get(key)
+    if hit and time.monotonic() - hit[0] < METRIC_CACHE_TTL:
+        return hit[1]
+    return None
+
+def _metric_cache_put(key, value):
+    if len(_metric_cache) > 256:
+        _metric_cache.clear()
+    _metric_cache[key] = (time.monotonic(), value)
+
+def _prom_iso(ts: datetime) -> str:
+    # isoformat is a direct buffer write, unlike locale-aware strftime
+    iso = ts.replace(microsecond=0).isoformat()
+    return iso.replace("+00:00", "Z") if iso.endswith("+00:00") else iso + "Z"
+
 # ---------------- TOOLS ----------------
 @tool
 def get_utc_times(period_hours: int = 1, offset_minutes: int = 1):
     end_time = datetime.now(timezone.utc) - timedelta(minutes=offset_minutes)
     start_time = end_time - timedelta(hours=period_hours)
-    return {"start_time": start_time, "end_time": end_time}
+    return {"start_time": start_time, "end_time": end_time,
+            "start_iso": _prom_iso(start_time), "end_iso": _prom_iso(end_time)}
 
 @tool
 def execute_ssm_command(instance_id: str, command: str) -> str:
     try:
-        if flag:
-            print("\nAgent command: ", command)
+        log.debug("Agent command: %s", command)
+        cacheable = _ssm_cacheable(command)
+        cache_key = (instance_id, command)
+        if cacheable:
+            hit = _ssm_cache.get(cache_key)
+            if hit and time.monotonic() - hit[0] < SSM_CACHE_TTL:
+                return hit[1]
         res = ssm_client.send_command(
             InstanceIds=[instance_id],
             DocumentName="AWS-RunShellScript",
@@ -281,37 +365,128 @@ def execute_ssm_command(instance_id: str, command: str) -> str:
             TimeoutSeconds=60
         )
         cmd_id = res['Command']['CommandId']
-        status = ""
-        while status not in ["Success", "Failed", "Cancelled"]:
-            time.sleep(1)
-            output = ssm_client.get_command_invocation(CommandId=cmd_id, InstanceId=instance_id)
-            status = output['Status']
-        if flag:
-            print("\nSSM RESULT: ", output.get("StandardOutputContent", "").strip() or "No output returned")
-        return output.get("StandardOutputContent", "").strip() or "No output returned"
+        # Poll status with the lightweight list API (Details=False carries no
+        # output payload) and back off; the full StandardOutputContent is
+        # fetched exactly once, after the command reaches a terminal state.
+        delay = 0.5
+        for _ in range(40):
+            inv = ssm_client.list_command_invocations(
+                CommandId=cmd_id, InstanceId=instance_id, Details=False)
+            invocations = inv.get("CommandInvocations", [])
+            status = invocations[0]["Status"] if invocations else "Pending"
+            if status not in ("Pending", "InProgress", "Delayed"):
+                break
+            time.sleep(delay)
+            delay = min(delay * 1.5, 5.0)
+        output = ssm_client.get_command_invocation(CommandId=cmd_id, InstanceId=instance_id)
+        out = output.get("StandardOutputContent", "").strip() or "No output returned"
+        log.debug("SSM result: %s", out)
+        # Don't ship megabyte logs to Bedrock: keep the head for context plus
+        # the tail where the recent errors live, under a hard byte cap
+        lines = out.splitlines()
+        if len(lines) > 400:
+            out = "\n".join(lines[:100]
+                            + [f"...[truncated {len(lines) - 400} lines]..."]
+                            + lines[-300:])
+        out = out[:64_000]
+        if cacheable and output.get("Status") == "Success":
+            if len(_ssm_cache) > 256:
+                _ssm_cache.clear()
+            _ssm_cache[cache_key] = (time.monotonic(), out)
+        return out
     except Exception as e:
         return f"Error executing command: {e}"
 
 @tool
-def get_metric(dim_name: str, value_id: str, start_time: datetime, end_time: datetime,
-               metric_name: str, namespace: str, label: str) -> List[Dict]:
+def get_metrics_batch(queries: List[Dict], start_time: datetime, end_time: datetime) -> Dict[str, List[Dict]]:
+    """
+    Fetch several CloudWatch metrics in one GetMetricData call.
+
+    Parameters:
+    - queries: list of dicts, one per metric:
+        [{"namespace": "AWS/EC2", "metric_name": "NetworkIn",
+          "dimensions": [{"Name": "InstanceId", "Value": "i-..."}], "label": "NetworkIn"}, ...]
+    - start_time / end_time: UTC window for the metrics.
+
+    Returns:
+    - Dict mapping each label to a compact column layout:
+        {'<label>': {'timestamps': [datetime, ...], '<label>': [value, ...]}, ...}
+
+    Use this once for all network/RDS/CloudWatch metrics of an anomaly window
+    instead of one get_metric call per metric; up to 500 metrics per request.
+    The column layout halves the serialized size versus one dict per point.
+    """
+    cache_key = hashlib.blake2b(repr((queries, start_time, end_time)).encode()).hexdigest()
+    cached = _metric_cache_get(cache_key)
+    if cached is not None:
+        return cached
     try:
-        if flag:
-            print(f"\nFetching metric: {metric_name} from namespace {namespace}")
-        resp = cloudwatch_client.get_metric_statistics(
-            Namespace=namespace,
-            MetricName=metric_name,
-            Dimensions=[{"Name": dim_name, "Value": value_id}],
-            StartTime=start_time,
-            EndTime=end_time,
-            Period=60,
-            Statistics=["Average"]
-        )
-        points = sorted(resp.get("Datapoints", []), key=lambda x: x["Timestamp"])
-        return [{"Timestamp": dp["Timestamp"], label: dp["Average"]} for dp in points]
+        series = {}
+        # CloudWatch accepts up to 500 MetricDataQueries per request
+        for chunk_start in range(0, len(queries), 500):
+            chunk = queries[chunk_start:chunk_start + 500]
+            metric_queries = [
+                {
+                    "Id": f"m{chunk_start + i}",
+                    "MetricStat": {
+                        "Metric": {
+                            "Namespace": q["namespace"],
+                            "MetricName": q["metric_name"],
+                            "Dimensions": q.get("dimensions", []),
+                        },
+                        "Period": 60,
+                        "Stat": "Average",
+                    },
+                    "ReturnData": True,
+                }
+                for i, q in enumerate(chunk)
+            ]
+            label_by_id = {f"m{chunk_start + i}": q.get("label", f"m{chunk_start + i}")
+                           for i, q in enumerate(chunk)}
+
+            next_token = None
+            while True:
+                kwargs = {
+                    "MetricDataQueries": metric_queries,
+                    "StartTime": start_time,
+                    "EndTime": end_time,
+                    "ScanBy": "TimestampAscending",
+                }
+                if next_token:
+                    kwargs["NextToken"] = next_token
+                resp = cloudwatch_client.get_metric_data(**kwargs)
+                for res in resp.get("MetricDataResults", []):
+                    label = label_by_id.get(res["Id"], res["Id"])
+                    col = series.setdefault(label, {"timestamps": [], label: []})
+                    # GetMetricData already returns parallel Timestamps/Values
+                    # arrays, so keep the columnar shape instead of zipping
+                    # them into one dict per point
+                    col["timestamps"].extend(res["Timestamps"])
+                    col[label].extend(res["Values"])
+                next_token = resp.get("NextToken")
+                if not next_token:
+                    break
+        _metric_cache_put(cache_key, series)
+        return series
     except Exception as e:
-        print(f"Error fetching {metric_name}: {e}")
-        return []
+        log.error("Error fetching metrics batch: %s", e)
+        return {}
+
+@tool
+def get_metric(dim_name: str, value_id: str, start_time: datetime, end_time: datetime,
+               metric_name: str, namespace: str, label: str) -> Dict:
+    log.debug("Fetching metric: %s from namespace %s", metric_name, namespace)
+    series = get_metrics_batch(
+        [{
+            "namespace": namespace,
+            "metric_name": metric_name,
+            "dimensions": [{"Name": dim_name, "Value": value_id}],
+            "label": label,
+        }],
+        start_time,
+        end_time,
+    )
+    return series.get(label, {"timestamps": [], label: []})
 
 @tool
 def query_prometheus(metric_type: str, start_time: datetime, end_time: datetime,promql:str, step: str ) -> List[Dict]:
@@ -330,22 +505,30 @@ def query_prometheus(metric_type: str, start_time: datetime, end_time: datetime,
             - nginx_active: 'nginx_connections_active',
             - step: Step interval in Prometheus duration format (e.g., '30s', '1m', '5m', '15m', '1h').
     Returns:
-    - List of dicts with timestamp, value, and metric labels.
+    - List of dicts, one per series:
+      {'metric': labels, 'timestamps': [datetime, ...], 'values': [float, ...]}.
     """
     
-    print(f"\n{promql}")
+    log.debug("PromQL: %s", promql)
         # Ensure UTC ISO format for Prometheus API
-    start_iso = start_time.strftime("%Y-%m-%dT%H:%M:%SZ")
-    end_iso = end_time.strftime("%Y-%m-%dT%H:%M:%SZ")
+    start_iso = _prom_iso(start_time)
+    end_iso = _prom_iso(end_time)
+
+    cache_key = hashlib.blake2b(f"{promql}{start_iso}{end_iso}{step}".encode()).hexdigest()
+    cached = _metric_cache_get(cache_key)
+    if cached is not None:
+        return cached
 
     try:
-        response = requests.get(
+        response = _PROM_SESSION.get(
             f"{PROMETHEUS_URL}/api/v1/query_range",
             params={"query": promql, "start": start_iso, "end": end_iso, "step": step},
             timeout=10
         )
         response.raise_for_status()
-        data = response.json()
+        # Range responses for an hour at fine step run to hundreds of KB;
+        # orjson parses them several times faster than stdlib json
+        data = orjson.loads(response.content)
 
         if data.get("status") != "success":
             return [{"error": "Prometheus query failed", "details": data}]
@@ -353,39 +536,143 @@ def query_prometheus(metric_type: str, start_time: datetime, end_time: datetime,
         results = []
         for result in data["data"].get("result", []):
             metric_labels = result.get("metric", {})
-            for timestamp, value in result.get("values", []):
-                results.append({
-                    "timestamp": datetime.fromtimestamp(timestamp, tz=timezone.utc),
-                    "value": float(value),
-                    "metric": metric_labels
-                })
-        print(f"\nPromethus Result: {results}\n")
+            samples = result.get("values", [])
+            # One numpy pass converts every [ts, "value"] pair instead of
+            # allocating a dict per sample
+            arr = np.asarray(samples, dtype=np.float64) if samples else np.empty((0, 2))
+            results.append({
+                "metric": metric_labels,
+                "timestamps": [datetime.fromtimestamp(t, tz=timezone.utc) for t in arr[:, 0]],
+                "values": arr[:, 1].tolist(),
+            })
+        # Lazy %s means the (potentially huge) result dict is only formatted
+        # when debug logging is actually on
+        log.debug("Prometheus result: %s", results)
+        _metric_cache_put(cache_key, results)
         return results
 
     except requests.exceptions.RequestException as e:
         return [{"error": f"HTTP error: {e}"}]
     except Exception as e:
         return [{"error": f"Unexpected error: {e}"}]
+
+@tool
+def query_prometheus_multi(queries: List[Dict], start_time: datetime, end_time: datetime) -> Dict:
+    """
+    Run several PromQL range queries in parallel and return all results.
+
+    Parameters:
+    - queries: list of dicts, one per query:
+        [{"promql": "...", "step": "1m", "label": "cpu"}, ...]
+    - start_time / end_time: UTC window shared by all queries.
+
+    Returns:
+    - Dict mapping each label to the same series list query_prometheus returns.
+
+    Use this to fetch the CPU/memory/disk/NGINX metrics of an anomaly window
+    in one call; the queries run concurrently, so the whole batch costs about
+    as much wallclock as the slowest single query.
+    """
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        futures = {
+            q.get("label", q["promql"]): pool.submit(
+                query_prometheus, q.get("label", ""), start_time, end_time,
+                q["promql"], q.get("step", "1m"))
+            for q in queries
+        }
+        return {label: fut.result() for label, fut in futures.items()}
+
+@tool
+def clear_metric_cache() -> str:
+    """
+    Drop all cached Prometheus and CloudWatch results.
+
+    Call this if cached metric data is suspected to be stale (e.g. the anomaly
+    window was re-anchored); subsequent queries hit the backends fresh.
+    """
+    _metric_cache.clear()
+    return "metric cache cleared"
 # ---------------- FASTAPI SETUP ----------------
-app = FastAPI()
-tools = [execute_ssm_command, get_utc_times, get_metric,query_prometheus]
+app = FastAPI(default_response_class=ORJSONResponse)
+# Bounded pool so an alert storm queues instead of spawning a thread (and a
+# Bedrock call) per webhook
+AGENT_EXECUTOR = ThreadPoolExecutor(max_workers=6, thread_name_prefix="agent")
+tools = [execute_ssm_command, get_utc_times, get_metrics_batch, get_metric,query_prometheus,query_prometheus_multi,clear_metric_cache]
+# Build one agent per executor thread instead of per request; construction
+# re-registers every tool and re-processes the multi-KB system prompt, so
+# it happens at most max_workers times. Strands agents keep conversation
+# state, so thread-local instances (with history cleared before each run)
+# keep alerts isolated without serializing the whole pool behind a lock.
+_AGENT_TLS = threading.local()
+
+def _get_monitor_agent():
+    agent = getattr(_AGENT_TLS, "agent", None)
+    if agent is None:
+        agent = Agent(name="MonitorAgent", system_prompt=system_prompt, model=model, tools=tools)
+        _AGENT_TLS.agent = agent
+    # Each alert is an independent investigation; drop the previous
+    # alert's transcript so it neither leaks into nor bloats this call
+    agent.messages = []
+    return agent
+
+# Flapping conditions re-fire near-identical alert payloads; embed each one
+# and reuse the previous analysis when a recent alert is semantically the
+# same, skipping the whole Bedrock investigation. Vectors are stored
+# normalized in float16, so cosine similarity is a single matrix-vector dot.
+ALERT_CACHE_TTL = 900
+ALERT_CACHE_SIM = 0.90
+_alert_encoder = SentenceTransformer("sentence-transformers/all-MiniLM-L6-v2")
+_alert_vectors = np.empty((0, 384), dtype=np.float16)
+_alert_entries = []  # (monotonic_ts, cached response) per vector row
+_ALERT_CACHE_LOCK = threading.Lock()
+
+def _alert_cache_lookup(alert_info: str):
+    vec = _alert_encoder.encode(alert_info, normalize_embeddings=True)
+    with _ALERT_CACHE_LOCK:
+        if _alert_entries:
+            sims = _alert_vectors.astype(np.float32) @ vec.astype(np.float32)
+            best = int(np.argmax(sims))
+            ts, response = _alert_entries[best]
+            if sims[best] >= ALERT_CACHE_SIM and time.monotonic() - ts < ALERT_CACHE_TTL:
+                return vec, response
+    return vec, None
+
+def _alert_cache_store(vec, response: str):
+    global _alert_vectors
+    with _ALERT_CACHE_LOCK:
+        if len(_alert_entries) > 256:
+            _alert_vectors = np.empty((0, 384), dtype=np.float16)
+            _alert_entries.clear()
+        _alert_vectors = np.vstack([_alert_vectors, vec.astype(np.float16)])
+        _alert_entries.append((time.monotonic(), response))
+
 def run_agent(alert_info: str):
     try:
-        print(f"\n{alert_info}")
-        monitor_agent = Agent(name="MonitorAgent", system_prompt=system_prompt, model=model, tools=tools)
-        result = monitor_agent(alert_info)
-        # print("\nAGENT RESPONSE:\n", result)
+        log.info("Alert received: %s", alert_info)
+        vec, cached = _alert_cache_lookup(alert_info)
+        if cached is not None:
+            log.info("Cached analysis for similar recent alert:\n%s", cached)
+            return
+        result = _get_monitor_agent()(alert_info)
+        _alert_cache_store(vec, str(result))
+        log.debug("Agent response: %s", result)
     except Exception as e:
-        print(f"Error running agent: {e}")
+        log.error("Error running agent: %s", e)
 
 @app.post("/trigger-agent")
 async def trigger_agent(request: Request):
     payload = await request.json()
     alert_info = payload.get("alerts", "No alert info received")
-    threading.Thread(target=run_agent, args=(str(alert_info),)).start()
+    # Compact JSON instead of Python repr: unambiguous for the model and
+    # fewer prompt tokens
+    AGENT_EXECUTOR.submit(run_agent, json.dumps(alert_info, separators=(",", ":"), default=str))
     return {"status": "agent triggered"}
 
+@app.on_event("shutdown")
+def shutdown_agent_executor():
+    AGENT_EXECUTOR.shutdown(wait=False, cancel_futures=True)
+
 # ---------------- RUN AGENT LOCALLY ----------------
 if __name__ == "__main__":
-    print("📊 CloudWatch + SSM Monitoring Agent Starting...")
+    log.info("📊 CloudWatch + SSM Monitoring Agent Starting...")
     uvicorn.run(app, host="0.0.0.0", port=5000)
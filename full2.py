@@ -1,18 +1,43 @@
 import time
 from datetime import datetime, timedelta, timezone
 import boto3
+from botocore.config import Config
 import shlex
 from strands import Agent, tool
 from strands.models import BedrockModel
 import re
 import functools
+import numpy as np
+from numba import njit
+from concurrent.futures import ThreadPoolExecutor
 
 # ---------------- CONFIGURATION ----------------
 REGION = "ap-south-1"
 INSTANCE_ID = "i-0bb4262df055138b2"
 
-ssm_client = boto3.client("ssm", region_name=REGION)
-cloudwatch_client = boto3.client("cloudwatch", region_name=REGION)
+# Pool sized for the thread-pool parallelism below; adaptive retries smooth
+# over throttling instead of failing the iteration
+boto_config = Config(max_pool_connections=32, retries={"mode": "adaptive"})
+ssm_client = boto3.client("ssm", region_name=REGION, config=boto_config)
+cloudwatch_client = boto3.client("cloudwatch", region_name=REGION, config=boto_config)
+ec2_client = boto3.client("ec2", region_name=REGION, config=boto_config)
+
+# Shared pool for overlapping independent AWS calls; boto3 releases the GIL
+# during network I/O so threads work well here
+AWS_POOL = ThreadPoolExecutor(max_workers=16)
+# The strands agent keeps conversation state, so analysis gets its own
+# single worker and must never overlap with itself
+ANALYSIS_POOL = ThreadPoolExecutor(max_workers=1)
+analysis_future = None
+
+# Compiled once; character classes only, so matching never backtracks
+# across a long command line
+_SITE_REGEX = re.compile(r'/var/www/([^/\s]+)/')
+
+# The gunicorn site list only changes on deploys, but the loop re-ran the
+# SSM discovery every 60s; cache it for 10 minutes per instance
+SITES_CACHE_TTL = 600
+_sites_cache = {}
 
 # ---------------- AGENT SETUP ----------------
 system_prompt = """
@@ -85,17 +110,85 @@ def time_it(func):
     """Decorator to measure and print the execution time of a function."""
     @functools.wraps(func)
     def wrapper(*args, **kwargs):
-        start_time = time.time()
+        start_time = time.monotonic()
         result = func(*args, **kwargs)
-        end_time = time.time()
+        end_time = time.monotonic()
         print(f"⌛ Execution time of '{func.__name__}': {end_time - start_time:.4f} seconds")
         return result
     return wrapper
 
 # ---------------- FUNCTIONS ----------------
 
+def _run_ssm(instance_id: str, commands):
+    """
+    Send one SSM RunShellScript invocation and return the invocation
+    response once the command reaches a terminal state.
+    Args:
+        instance_id (str): The ID of the EC2 instance.
+        commands: A command string or list of command strings.
+    Returns:
+        dict: The get_command_invocation response.
+    """
+    if isinstance(commands, str):
+        commands = [commands]
+    res = ssm_client.send_command(
+        InstanceIds=[instance_id],
+        DocumentName="AWS-RunShellScript",
+        Parameters={"commands": commands},
+        TimeoutSeconds=60
+    )
+    cmd_id = res['Command']['CommandId']
+    # Poll immediately with exponential backoff: warm-instance commands
+    # often finish in <500ms, so a fixed 1s waiter delay wastes most of
+    # the round-trip
+    output = {}
+    delay = 0.1
+    for _ in range(120):
+        try:
+            output = ssm_client.get_command_invocation(CommandId=cmd_id, InstanceId=instance_id)
+        except ssm_client.exceptions.InvocationDoesNotExist:
+            # Invocation record may lag send_command by a few hundred ms
+            output = {}
+        if output.get("Status") not in (None, "Pending", "InProgress", "Delayed"):
+            break
+        time.sleep(delay)
+        delay = min(1.0, delay * 1.5)
+    return output
+
+def run_ssm_batch(instance_id: str, cmds: list):
+    """
+    Execute several shell commands in ONE SSM invocation and return their
+    outputs individually.
+    Args:
+        instance_id (str): The ID of the EC2 instance.
+        cmds (list): Shell command strings to run sequentially.
+    Returns:
+        list: One stdout string per command, in order.
+
+    Commands are separated by ===CMDk=== sentinel markers so a whole
+    iteration's worth of shell work costs a single control-plane
+    round-trip instead of one per command.
+    """
+    marked = []
+    for i, c in enumerate(cmds):
+        marked.append(f"echo '===CMD{i}==='")
+        marked.append(c)
+    output = _run_ssm(instance_id, marked)
+    content = output.get("StandardOutputContent", "")
+    outs = []
+    for i in range(len(cmds)):
+        start_marker = f"===CMD{i}==="
+        start = content.find(start_marker)
+        if start == -1:
+            outs.append("")
+            continue
+        start += len(start_marker)
+        end = content.find(f"===CMD{i + 1}===", start)
+        outs.append(content[start:end if end != -1 else len(content)].strip())
+    return outs
+
 @time_it
-  
+
 def get_ec2_status(instance_id: str):
     """
     Get the current operational status of an EC2 instance.
@@ -104,7 +197,6 @@ def get_ec2_status(instance_id: str):
     Returns:
         tuple: A tuple containing the state, system status, and instance status.
     """
-    ec2_client = boto3.client("ec2", region_name=REGION)
     try:
         response = ec2_client.describe_instances(InstanceIds=[instance_id])
         state = response["Reservations"][0]["Instances"][0]["State"]["Name"]
@@ -121,7 +213,55 @@ def get_ec2_status(instance_id: str):
         print(f"Error fetching EC2 status: {e}")
         return "unknown", "unknown", "unknown"
 
-@time_it 
+def _get_metric_data_series(queries: list, start_time: datetime, end_time: datetime):
+    """
+    Fetch several CloudWatch metrics with one GetMetricData call.
+    Args:
+        queries (list): Dicts with 'id', 'namespace', 'metric_name' and
+            'dimensions', or just 'id' and 'expression' for a Metrics
+            Insights SQL query.
+        start_time (datetime): The start of the time window.
+        end_time (datetime): The end of the time window.
+    Returns:
+        dict: Mapping of query id to a list of (Timestamp, Value) pairs.
+    """
+    metric_queries = []
+    for q in queries:
+        if "expression" in q:
+            # Metrics Insights aggregates server-side, so one SQL query
+            # covers what would otherwise be one MetricStat per dimension
+            metric_queries.append({"Id": q["id"], "Expression": q["expression"],
+                                   "Period": 60})
+        else:
+            metric_queries.append({
+                "Id": q["id"],
+                "MetricStat": {
+                    "Metric": {
+                        "Namespace": q["namespace"],
+                        "MetricName": q["metric_name"],
+                        "Dimensions": q["dimensions"],
+                    },
+                    "Period": 60,
+                    "Stat": "Average",
+                },
+            })
+    series = {}
+    next_token = None
+    while True:
+        kwargs = {"MetricDataQueries": metric_queries,
+                  "StartTime": start_time, "EndTime": end_time,
+                  "ScanBy": "TimestampAscending"}
+        if next_token:
+            kwargs["NextToken"] = next_token
+        resp = cloudwatch_client.get_metric_data(**kwargs)
+        for res in resp.get("MetricDataResults", []):
+            series.setdefault(res["Id"], []).extend(zip(res["Timestamps"], res["Values"]))
+        next_token = resp.get("NextToken")
+        if not next_token:
+            break
+    return series
+
+@time_it
 def get_cpu_per_minute(instance_id: str, start_time: datetime, end_time: datetime):
     """
     Fetch CPU utilization metrics per minute from CloudWatch.
@@ -133,19 +273,16 @@ def get_cpu_per_minute(instance_id: str, start_time: datetime, end_time: datetim
         list: A list of dictionaries with timestamp and CPU usage.
     """
     try:
-        resp = cloudwatch_client.get_metric_statistics(
-            Namespace="AWS/EC2",
-            MetricName="CPUUtilization",
-            Dimensions=[{"Name": "InstanceId", "Value": instance_id}],
-            StartTime=start_time,
-            EndTime=end_time,
-            Period=60,
-            Statistics=["Average"],
-            Unit="Percent"
-        )
-
-        points = sorted(resp.get("Datapoints", []), key=lambda x: x["Timestamp"])
-        return [{"Timestamp": dp["Timestamp"], "CPU": dp["Average"]} for dp in points]
+        # A single Metrics Insights SQL query returns the averaged series;
+        # more SELECTs (memory/disk/DynamoDB) can ride the same call later
+        insights = ('SELECT AVG(CPUUtilization) FROM "AWS/EC2" '
+                    f"WHERE InstanceId = '{instance_id}' GROUP BY InstanceId")
+        series = _get_metric_data_series(
+            [{"id": "cpu", "expression": insights}], start_time, end_time)
+
+        # ScanBy ascending means the API already returns chronological
+        # order — no O(N log N) re-sort needed here
+        return [{"Timestamp": t, "CPU": v} for t, v in series.get("cpu", [])]
     except Exception as e:
         print(f"Error fetching CPU metrics: {e}")
         return []
@@ -160,27 +297,18 @@ def get_all_gunicorn_sites(instance_id: str):
     Returns:
         list: A list of dictionaries with site name and log path.
     """
-    cmd = "ps aux | grep gunicorn | grep -v 'grep'"
-    
+    hit = _sites_cache.get(instance_id)
+    if hit and time.monotonic() - hit[0] < SITES_CACHE_TTL:
+        return hit[1]
+
+    # pgrep emits just "PID cmdline" for matching processes — no ps header,
+    # no self-matching grep to filter out, far less output to ship back
+    cmd = "pgrep -a -f 'gunicorn.*\\.sock'"
+
     # Send a single SSM command to get the list of processes
     try:
-        res = ssm_client.send_command(
-            InstanceIds=[instance_id],
-            DocumentName="AWS-RunShellScript",
-            Parameters={"commands": [cmd]},
-            TimeoutSeconds=60
-        )
-        cmd_id = res['Command']['CommandId']
-        time.sleep(2)
-        
-        # Poll for command status until it's complete
-        status = ''
-        while status not in ['Success', 'Failed', 'Cancelled']:
-            time.sleep(1)
-            output = ssm_client.get_command_invocation(CommandId=cmd_id, InstanceId=instance_id)
-            status = output['Status']
-
-        if status == 'Success':
+        output = _run_ssm(instance_id, cmd)
+        if output.get('Status') == 'Success':
             processes = output.get("StandardOutputContent", "").strip().splitlines()
         else:
             print(f"SSM Command Failed: {output.get('StandardErrorContent', '')}")
@@ -190,23 +318,38 @@ def get_all_gunicorn_sites(instance_id: str):
         processes = []
     
     sites = []
-    # Regex to capture the site name from the .sock file and the log path
-    log_path_regex = re.compile(r'/var/www/(?P<site_name>.*?)/\S*\.sock.*?--access-logfile (?P<access_log>\S+)')
-
     for line in processes:
-        match = log_path_regex.search(line)
-        if match:
-            site_name = match.group('site_name')
-            access_log = match.group('access_log')
-            
-            # Assume log path is relative if not absolute
-            if not access_log.startswith('/'):
-                access_log = f"/var/www/{site_name}/logs/{access_log}"
-
-            sites.append({
-                "site_name": site_name,
-                "access_log_path": access_log
-            })
+        site_match = _SITE_REGEX.search(line)
+        if not site_match:
+            continue
+        site_name = site_match.group(1)
+
+        # Tokenize the command line and scan for the flag instead of
+        # backtracking a regex over the whole line
+        access_log = None
+        tokens = shlex.split(line)
+        for i, tok in enumerate(tokens):
+            if tok == '--access-logfile' and i + 1 < len(tokens):
+                access_log = tokens[i + 1]
+                break
+            if tok.startswith('--access-logfile='):
+                access_log = tok.split('=', 1)[1]
+                break
+        if access_log is None:
+            continue
+
+        # Assume log path is relative if not absolute
+        if not access_log.startswith('/'):
+            access_log = f"/var/www/{site_name}/logs/{access_log}"
+
+        sites.append({
+            "site_name": site_name,
+            "access_log_path": access_log
+        })
+    # Don't cache an empty list — it usually means the SSM call failed,
+    # not that every site disappeared
+    if sites:
+        _sites_cache[instance_id] = (time.monotonic(), sites)
     return sites
 
 @time_it 
@@ -225,27 +368,6 @@ def get_log_counts_for_sites(instance_id: str, sites: list, spike_time: datetime
     """
     log_counts = {site['site_name']: {'before': 0, 'spike': 0, 'after': 0} for site in sites}
 
-    def count_logs(site, start_time, end_time):
-        start_str = start_time.strftime("%d/%b/%Y:%H:%M:%S")
-        end_str = end_time.strftime("%d/%b/%Y:%H:%M:%S")
-
-        cmd = f"awk -v start='{start_str}' -v end='{end_str}' '{{ t = substr($4, 2, 19); if (t >= start && t <= end) print }}' {site['access_log_path']} | wc -l"
-
-        try:
-            res = ssm_client.send_command(
-                InstanceIds=[INSTANCE_ID],
-                DocumentName="AWS-RunShellScript",
-                Parameters={"commands": [cmd]},
-                TimeoutSeconds=60
-            )
-            cmd_id = res['Command']['CommandId']
-            time.sleep(2)
-            output = ssm_client.get_command_invocation(CommandId=cmd_id, InstanceId=INSTANCE_ID)
-            return int(output.get("StandardOutputContent", "0").strip() or 0)
-        except Exception as e:
-            print(f"Error counting logs for {site['site_name']}: {e}")
-            return 0
-
     # Define windows
     pre_spike_start = spike_time - timedelta(minutes=10)
     pre_spike_end = spike_time - timedelta(seconds=1)  # 1 second before spike
@@ -254,17 +376,60 @@ def get_log_counts_for_sites(instance_id: str, sites: list, spike_time: datetime
     post_spike_start = spike_time + timedelta(minutes=1)  # start after spike minute
     post_spike_end = spike_time + timedelta(minutes=11)   # 10 minutes after spike
 
-    # Pre-spike counts
-    for site in sites:
-        log_counts[site['site_name']]['before'] = count_logs(site, pre_spike_start, pre_spike_end)
-
-    # Spike counts
-    for site in sites:
-        log_counts[site['site_name']]['spike'] = count_logs(site, spike_start, spike_end)
+    # Convert the six window bounds exactly once, up front
+    b1, b2 = int(pre_spike_start.timestamp()), int(pre_spike_end.timestamp())
+    s1, s2 = int(spike_start.timestamp()), int(spike_end.timestamp())
+    a1, a2 = int(post_spike_start.timestamp()), int(post_spike_end.timestamp())
+
+    # One awk scans every access log exactly once, keyed by FILENAME with all
+    # three window counters held per file — a single disk pass per log and a
+    # single SSM round-trip for the whole fleet of sites
+    path_to_site = {site['access_log_path']: site['site_name'] for site in sites}
+    # Logs grow without bound while the three windows only span ~21 minutes;
+    # estimate each log's bytes/minute from its size and age and tail just
+    # that much into awk instead of scanning the full file. tail -c reads
+    # back from EOF, so the byte budget must reach from the earliest window
+    # bound all the way to now, not just the windows' span (3x safety
+    # factor on top, since the average rate underestimates bursts).
+    # Window bounds arrive as epoch seconds and each line's timestamp is
+    # converted once with mktime, so the range checks are integer compares
+    # rather than locale-dependent lexicographic string compares.
+    awk_prog = (
+        'BEGIN { split("Jan Feb Mar Apr May Jun Jul Aug Sep Oct Nov Dec", m, " "); '
+        "for (i in m) mon[m[i]] = i } "
+        "{ d = substr($4, 2, 20); "
+        'ts = mktime(substr(d,8,4) " " mon[substr(d,4,3)] " " substr(d,1,2) " " '
+        'substr(d,13,2) " " substr(d,16,2) " " substr(d,19,2)); '
+        "if (ts >= b1 && ts <= b2) c[FN \"|before\"]++; "
+        "if (ts >= s1 && ts <= s2) c[FN \"|spike\"]++; "
+        "if (ts >= a1 && ts <= a2) c[FN \"|after\"]++ } "
+        "END { for (k in c) print k \"|\" c[k] }"
+    )
+    cover_min = 3 * max(1, int((datetime.now(timezone.utc) - pre_spike_start).total_seconds() // 60) + 1)
+    cmd = (
+        "now=$(date +%s); "
+        f"for f in {' '.join(path_to_site)}; do "
+        'sz=$(stat -c %s "$f" 2>/dev/null) || continue; '
+        'birth=$(stat -c %W "$f"); '
+        'if [ "$birth" -gt 0 ]; then mins=$(( (now - birth) / 60 + 1 )); else mins=1440; fi; '
+        f"bytes=$(( sz / mins * {cover_min} )); "
+        "if [ $bytes -gt $sz ] || [ $bytes -le 0 ]; then bytes=$sz; fi; "
+        'tail -c $bytes "$f" | awk -v FN="$f" '
+        f"-v b1={b1} -v b2={b2} -v s1={s1} -v s2={s2} -v a1={a1} -v a2={a2} "
+        f"'{awk_prog}'; done"
+    )
 
-    # Post-spike counts
-    for site in sites:
-        log_counts[site['site_name']]['after'] = count_logs(site, post_spike_start, post_spike_end)
+    try:
+        for line in run_ssm_batch(INSTANCE_ID, [cmd])[0].splitlines():
+            parts = line.strip().split("|")
+            site = path_to_site.get(parts[0]) if len(parts) == 3 else None
+            if site and parts[1] in log_counts[site]:
+                log_counts[site][parts[1]] = int(parts[2] or 0)
+    except Exception as e:
+        print(f"Error counting logs for sites: {e}")
+        # A failed count often means a cached site/log path no longer
+        # exists; force rediscovery next iteration
+        _sites_cache.pop(instance_id, None)
 
     return log_counts
 
@@ -280,47 +445,105 @@ def fetch_logs_window(instance_id: str, log_path: str, start_time: datetime, end
     Returns:
         str: A string of log entries, or an error message.
     """
-    start_str = start_time.strftime("%d/%b/%Y:%H:%M:%S")
-    end_str = end_time.strftime("%d/%b/%Y:%H:%M:%S")
-    
-
-    # Use awk to filter logs in a single command
+    # Tail only the estimated bytes covering the window (3x safety factor)
+    # before filtering with awk, instead of scanning the whole log; tail -c
+    # reads back from EOF, so the budget spans from the window start to now
+    # rather than just the window itself. Window bounds are epoch seconds
+    # so awk compares integers, not strings
+    cover_min = max(1, int((datetime.now(timezone.utc) - start_time).total_seconds() // 60) + 1)
     cmd = (
-    f"awk -v start='{start_str}' -v end='{end_str}' '{{ "
-    f"t = substr($4, 2, 20); "  # <-- use 20, includes seconds
-    f"if (t >= start && t <= end) print "
-    f"}}' {log_path} || echo 'No logs found in the window.'"
+    f'f={log_path}; sz=$(stat -c %s "$f"); birth=$(stat -c %W "$f"); now=$(date +%s); '
+    'if [ "$birth" -gt 0 ]; then mins=$(( (now - birth) / 60 + 1 )); else mins=1440; fi; '
+    f"bytes=$(( sz / mins * {cover_min} * 3 )); "
+    "if [ $bytes -gt $sz ] || [ $bytes -le 0 ]; then bytes=$sz; fi; "
+    'tail -c $bytes "$f" | '
+    f"awk -v start={int(start_time.timestamp())} -v end={int(end_time.timestamp())} "
+    "'BEGIN { split(\"Jan Feb Mar Apr May Jun Jul Aug Sep Oct Nov Dec\", m, \" \"); "
+    "for (i in m) mon[m[i]] = i } "
+    "{ d = substr($4, 2, 20); "
+    'ts = mktime(substr(d,8,4) " " mon[substr(d,4,3)] " " substr(d,1,2) " " '
+    'substr(d,13,2) " " substr(d,16,2) " " substr(d,19,2)); '
+    "if (ts >= start && ts <= end) print "
+    "}' || echo 'No logs found in the window.'"
 )
 
     try:
-        res = ssm_client.send_command(
-            InstanceIds=[instance_id],
-            DocumentName="AWS-RunShellScript",
-            Parameters={"commands": [cmd]},
-            TimeoutSeconds=60
-        )
-        cmd_id = res['Command']['CommandId']
-        time.sleep(2)
-        output = ssm_client.get_command_invocation(CommandId=cmd_id, InstanceId=instance_id)
-        logs = output.get("StandardOutputContent", "").strip()
+        logs = run_ssm_batch(instance_id, [cmd])[0]
         return logs if logs else "No logs found in the window."
     except Exception as e:
         return f"Error fetching logs: {e}"
 
+# Matches the HTTP status field of a combined-format access log line
+_STATUS_REGEX = re.compile(r'" (\d{3}) ')
+
+def _filter_log_lines(logs: str, max_lines: int = 500):
+    """
+    Keep only error lines (HTTP status >= 400) from a log dump, falling back
+    to all lines when none match, capped to the newest max_lines. Bedrock
+    cost and latency scale with prompt tokens, so the agent only sees the
+    lines that carry signal.
+    """
+    lines = logs.splitlines()
+    filtered = [l for l in lines
+                if (m := _STATUS_REGEX.search(l)) and int(m.group(1)) >= 400]
+    if not filtered:
+        filtered = lines
+    return "\n".join(filtered[-max_lines:])
+
+@njit(cache=True)
+def analyze_counts(before, spike, after):
+    """
+    Per-site spike-magnitude scan over int64 count arrays: the magnitude
+    is the largest pairwise difference between the three windows.
+    Returns (index of the biggest spike or -1, magnitudes array).
+    Compiled with numba so the scan stays cheap as the number of
+    monitored sites/instances grows.
+    """
+    n = before.shape[0]
+    mags = np.empty(n, dtype=np.int64)
+    best_idx = -1
+    best_mag = 0
+    for i in range(n):
+        d1 = abs(spike[i] - before[i])
+        d2 = abs(after[i] - spike[i])
+        d3 = abs(after[i] - before[i])
+        m = d1 if d1 > d2 else d2
+        if d3 > m:
+            m = d3
+        mags[i] = m
+        if m > best_mag:
+            best_mag = m
+            best_idx = i
+    return best_idx, mags
+
+def _analyze_report(report: str):
+    try:
+        result = monitor_agent(f"Analyze the following metrics and provide a root cause analysis with recommended actions:\n{report}")
+        # print("\nAGENT RESPONSE:\n", result)
+    except Exception as e:
+        print(f"Error analyzing report with agent: {e}")
+
 # ---------------- MONITORING LOOP ----------------
 
 print("🌐 Started Monitoring...")
 
 while True:
+    tick = time.monotonic()
     try:
 
         # Step 1: Get EC2 status and CPU metrics
-        state, system_status, instance_status = get_ec2_status(INSTANCE_ID)
         now_utc = datetime.now(timezone.utc)
         one_hour_ago = now_utc - timedelta(minutes=15)
-        
-        cpu_per_minute = get_cpu_per_minute(INSTANCE_ID, start_time=one_hour_ago, end_time=now_utc)
-        
+
+        # EC2 status, CPU metrics and gunicorn discovery are independent;
+        # fire them together and block only when each result is needed
+        status_future = AWS_POOL.submit(get_ec2_status, INSTANCE_ID)
+        cpu_future = AWS_POOL.submit(get_cpu_per_minute, INSTANCE_ID, start_time=one_hour_ago, end_time=now_utc)
+        sites_future = AWS_POOL.submit(get_all_gunicorn_sites, INSTANCE_ID)
+
+        state, system_status, instance_status = status_future.result()
+        cpu_per_minute = cpu_future.result()
+
         print("\n--- Current EC2 Status ---")
         print(f"EC2 State: {state}")
         print(f"System Status: {system_status}")
@@ -350,7 +573,7 @@ while True:
             print(f"Post-spike analysis window: {post_spike_start_window} to {post_spike_end_window}")
 
             # Step 3: Get all Gunicorn sites and their log counts for both windows
-            all_sites = get_all_gunicorn_sites(INSTANCE_ID)
+            all_sites = sites_future.result()
 
             if not all_sites:
                 print("\nNo Gunicorn sites found running.")
@@ -371,25 +594,24 @@ while True:
     # key=lambda x: x[1],
     # default=(None, 0)
 # )
+                # Compiled spike-magnitude scan: diffs, max selection and
+                # argmax all run as native code inside analyze_counts, so
+                # this scales to hundreds of sites unchanged
+                site_names = list(log_counts)
+                arr = np.array([[log_counts[s]['before'], log_counts[s]['spike'], log_counts[s]['after']]
+                                for s in site_names], dtype=np.int64).reshape(-1, 3)
+                idx, mags = analyze_counts(np.ascontiguousarray(arr[:, 0]),
+                                           np.ascontiguousarray(arr[:, 1]),
+                                           np.ascontiguousarray(arr[:, 2]))
+
                 Spike_site = None
                 max_spike = 0
-                for site, counts in log_counts.items():
-                    before_count = counts.get('before', 0)
-                    spike_count = counts.get('spike', 0)
-                    after_count = counts.get('after', 0)
-
-                    # Compute ALL pairwise differences
-                    diff_before_spike = abs(spike_count - before_count)
-                    diff_spike_after = abs(after_count - spike_count)
-                    diff_before_after = abs(after_count - before_count)
-
-                    # Take the largest difference as the site's "spike magnitude"
-                    site_spike = max(diff_before_spike, diff_spike_after, diff_before_after)
-
-                    if site_spike > max_spike:
-                        max_spike = site_spike
-                        Spike_site = site
+                if idx >= 0:
+                    Spike_site = site_names[idx]
+                    max_spike = int(mags[idx])
 
+                for site, (before_count, spike_count, after_count), site_spike in zip(
+                        site_names, arr.tolist(), mags.tolist()):
                     print(f"Website: {site}")
                     print(f"  - Before Spike: {before_count} requests")
                     print(f"  - At Spike: {spike_count} requests")
@@ -409,43 +631,54 @@ while True:
 
 
 
-                report = f"""
-EC2 Status: {state}
-System Status: {system_status}
-Instance Status: {instance_status}
-CPU Utilization Per Minute (Last Hour):
-"""
-                for dp in cpu_per_minute:
-                    report += f"{dp['Timestamp']} - {dp['CPU']:.2f}% CPU\n"
-
-                report += f"\n🚨 Highest CPU spike detected at {spike_time} with {spike_value:.2f}% utilization.\n"
-                report += f"\n📊 Access log counts analysis for the spike window:\n" + "\n".join(report_metrics)
-                
                 if Spike_site and Spike_log_path:
                     print(f"\n--- Spike Identified ---")
                     print(f"🕵️‍♂️ Website with the most significant spike in requests: {Spike_site} with an difference of {max_spike} requests.")
 
-                    report += f"\n🕵️‍♂️ Website with the most significant spike in requests: {Spike_site} with an increase of {max_spike} requests.\n"
-
                     # Step 5: Fetch logs for the Spike site in the analysis window
-                    logs_from_Spike = fetch_logs_window(INSTANCE_ID, Spike_log_path, pre_spike_start_window, post_spike_end_window)
-                    report += f"\n📜 Detailed logs for {Spike_site} during the spike:\n{logs_from_Spike}\n"
+                    logs_from_Spike = _filter_log_lines(fetch_logs_window(INSTANCE_ID, Spike_log_path, pre_spike_start_window, post_spike_end_window))
+                    spike_section = (
+                        f"\n🕵️‍♂️ Website with the most significant spike in requests: {Spike_site} with an increase of {max_spike} requests.\n"
+                        f"\n📜 Detailed logs for {Spike_site} during the spike:\n{logs_from_Spike}\n"
+                    )
                     print(f"\n--- Detailed Logs for {Spike_site} ---\n{logs_from_Spike}")
                 else:
-                    report += "\nCould not identify a clear Spike website from log data.\n"
+                    spike_section = "\nCould not identify a clear Spike website from log data.\n"
                     print("\nCould not identify a clear Spike website from log data.")
+
+                # Assemble the report in one shot — join over a generator plus
+                # a single f-string instead of repeated += concatenation
+                cpu_lines = "\n".join(f"{dp['Timestamp']} - {dp['CPU']:.2f}% CPU" for dp in cpu_per_minute)
+                metric_lines = "\n".join(report_metrics)
+                report = f"""
+EC2 Status: {state}
+System Status: {system_status}
+Instance Status: {instance_status}
+CPU Utilization Per Minute (Last Hour):
+{cpu_lines}
+
+🚨 Highest CPU spike detected at {spike_time} with {spike_value:.2f}% utilization.
+
+📊 Access log counts analysis for the spike window:
+{metric_lines}{spike_section}"""
         
-        # Step 6: Send the report to the agent for analysis
+        # Step 6: Send the report to the agent for analysis. Submitting to
+        # the pool lets the multi-second LLM call overlap the sleep before
+        # the next iteration instead of stretching the loop period
         print("\n--- Sending to Agent ---")
         print("Sending the generated report to the AI agent for root cause analysis and recommendations...")
-        try:
-            result = monitor_agent(f"Analyze the following metrics and provide a root cause analysis with recommended actions:\n{report}")
-            # print("\nAGENT RESPONSE:\n", result)
-        except Exception as e:
-            print(f"Error analyzing report with agent: {e}")
+        # Skip this tick's analysis if the previous one is still running
+        # rather than invoking the shared agent from two threads or
+        # queueing reports without bound
+        if analysis_future is None or analysis_future.done():
+            analysis_future = ANALYSIS_POOL.submit(_analyze_report, report)
+        else:
+            print("⏳ Previous analysis still running; skipping this iteration's analysis.")
 
     except Exception as e:
         print(f"An error occurred in the main monitoring loop: {e}")
     
     print("---------------------------------------------------")
-    time.sleep(60)
+    # Sleep until the next 60s tick rather than 60s after the work ends,
+    # so iteration start times don't drift by the loop's own runtime
+    time.sleep(max(0.0, tick + 60 - time.monotonic()))